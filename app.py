@@ -1,73 +1,157 @@
 import streamlit as st
-from stmol import showmol
-import py3Dmol
-import tempfile
 import re
-import matplotlib.pyplot as plt
-import pandas as pd
-from collections import Counter
+import base64
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
-import seaborn as sns
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ESMFold API endpoint and per-request timeout in seconds
+ESMFOLD_URL = 'https://api.esmatlas.com/foldSequence/v1/pdb/'
+ESMFOLD_TIMEOUT = 60
+
+# Number of ESMFold requests kept in flight at once in multi-sequence mode
+MAX_WORKERS = 8
+
+# PDB files up to this size are embedded in the page as a data URI download link
+DATA_URI_MAX_BYTES = 1024 * 1024
+
+# Standard amino acids and their ASCII codes, used to index byte histograms
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+AMINO_ACID_CODES = np.frombuffer(AMINO_ACIDS.encode('ascii'), dtype=np.uint8)
+VALID_RESIDUE_BYTES = (AMINO_ACIDS + AMINO_ACIDS.lower()).encode('ascii')
+VALID_RESIDUE_CODES = np.zeros(256, dtype=bool)
+VALID_RESIDUE_CODES[AMINO_ACID_CODES] = True
+
+# Record boundaries and sequence whitespace in raw FASTA bytes
+FASTA_RECORD_START = re.compile(rb'^>', re.MULTILINE)
+FASTA_WHITESPACE = b' \t\r\n'
 
-# Define function to predict structure using ESMFold API
 @st.cache_resource
-def predict_structure_api(sequence):
-    """Use the ESMFold API to predict the protein structure."""
+def _session():
+    """Create the shared HTTP session used for all ESMFold API calls."""
+    session = requests.Session()
+    # Back off on rate limiting (429) and transient server errors; POST must be opted in to retries
+    retries = Retry(
+        total=5,
+        backoff_factor=1.0,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['POST'],
+    )
+    session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retries))
+    return session
+
+@st.cache_data(ttl=24 * 60 * 60, max_entries=512, show_spinner=False)
+def _fold_sequence(sequence):
+    """Call the ESMFold API and return the predicted PDB, caching results per sequence."""
     headers = {
-        'Content-Type': 'application/x-www-form-urlencoded',
+        'Content-Type': 'text/plain',
+        'Accept-Encoding': 'gzip',
     }
-    try:
-        response = requests.post('https://api.esmatlas.com/foldSequence/v1/pdb/', headers=headers, data=sequence, timeout=60)
+    with _session().post(ESMFOLD_URL, headers=headers, data=sequence.encode('ascii'), timeout=ESMFOLD_TIMEOUT, stream=True) as response:
         response.raise_for_status()
-        pdb_content = response.content.decode('utf-8')
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error during prediction: {e}")
-        pdb_content = None
-    return pdb_content
+        pdb_content = bytearray()
+        for chunk in response.iter_content(chunk_size=65536):
+            pdb_content.extend(chunk)
+    return pdb_content.decode('utf-8')
+
+# Define function to predict structure using ESMFold API
+def predict_structure_api(sequence):
+    """Use the ESMFold API to predict the protein structure, raising on request errors."""
+    # Normalize so whitespace and case variants share a cache entry
+    return _fold_sequence(sequence.strip().upper())
 
+@functools.lru_cache(maxsize=128)
 def validate_sequence(sequence):
     """Validate if the sequence contains only valid amino acid characters."""
-    valid_chars = re.compile(r'^[ACDEFGHIKLMNPQRSTVWYacdefghiklmnpqrstvwy]+$')
-    if valid_chars.match(sequence):
-        return True
-    else:
-        return False
+    # Non-ASCII characters become '?', so anything left after deleting valid residues is invalid
+    residues = sequence.strip().encode('ascii', 'replace')
+    return bool(residues) and not residues.translate(None, VALID_RESIDUE_BYTES)
+
+def prepare_sequence(sequence):
+    """Return the length, validity and upper-cased residue codes of a sequence in one pass."""
+    # Encoding with 'replace' turns non-ASCII input into '?', which fails the lookup below
+    residues = np.frombuffer(sequence.strip().encode('ascii', 'replace'), dtype=np.uint8)
+    residues = np.where((residues >= ord('a')) & (residues <= ord('z')), residues - 32, residues)
+    return residues.size, bool(residues.size) and bool(VALID_RESIDUE_CODES[residues].all()), residues
+
+def _parse_fasta_record(record):
+    """Split a raw FASTA record into its header and whitespace-free sequence."""
+    header, _, body = bytes(record[1:]).partition(b'\n')
+    return header.rstrip().decode('utf-8', 'replace'), body.translate(None, FASTA_WHITESPACE).decode('utf-8', 'replace')
 
-def show_structure(pdb_str, style='cartoon'):
-    """Use py3Dmol to show the structure with different styles."""
+def iter_fasta(data):
+    """Yield (header, sequence) tuples from a bytes-like FASTA buffer, one record at a time."""
+    start = None
+    for match in FASTA_RECORD_START.finditer(data):
+        if start is not None:
+            yield _parse_fasta_record(data[start:match.start()])
+        start = match.start()
+    if start is not None:
+        yield _parse_fasta_record(data[start:])
+
+@st.cache_data(show_spinner=False)
+def _make_view_html(pdb_str, style, spin):
+    """Build the py3Dmol viewer HTML for a structure, cached per structure, style and rotation."""
+    import py3Dmol
+    
     view = py3Dmol.view(width=800, height=500)
     view.addModel(pdb_str, "pdb")
     view.setStyle({style: {'color': 'spectrum'}})
     view.setBackgroundColor('white')
     view.zoomTo()
-    view.spin(True)
-    return view
-
-def plot_amino_acid_distribution(sequence):
-    """Plot the amino acid distribution in the given sequence."""
-    sequence = sequence.upper()
-    amino_acid_count = Counter(sequence)
-    amino_acids = list(amino_acid_count.keys())
-    counts = list(amino_acid_count.values())
+    view.spin(bool(spin))
+    return view._make_html()
+
+def show_structure(pdb_str, style='cartoon', spin=False):
+    """Use py3Dmol to show the structure with different styles, optionally auto-rotating."""
+    st.components.v1.html(_make_view_html(pdb_str, style, spin), height=500)
+
+def show_pdb_download(pdb_str, label, file_name):
+    """Offer a PDB file for download, embedding small files directly as a data URI link."""
+    pdb_bytes = pdb_str.encode('utf-8')
+    if len(pdb_bytes) > DATA_URI_MAX_BYTES:
+        st.download_button(label=label, data=pdb_bytes, file_name=file_name, mime="chemical/x-pdb")
+        return
+    pdb_b64 = base64.b64encode(pdb_bytes).decode('ascii')
+    st.markdown(f'<a download="{file_name}" href="data:chemical/x-pdb;base64,{pdb_b64}">{label}</a>', unsafe_allow_html=True)
+
+def plot_amino_acid_distribution(residues):
+    """Plot the amino acid distribution of upper-cased residue codes from prepare_sequence."""
+    import pandas as pd
+    
+    counts = np.bincount(residues, minlength=256)[AMINO_ACID_CODES]
     
-    fig, ax = plt.subplots()
-    ax.bar(amino_acids, counts, color='skyblue')
-    ax.set_xlabel('Amino Acid')
-    ax.set_ylabel('Count')
-    ax.set_title('Amino Acid Distribution')
-    st.pyplot(fig)
+    # Rendered client-side by Vega-Lite rather than building a matplotlib figure
+    distribution = pd.DataFrame({'Count': counts}, index=pd.Index(list(AMINO_ACIDS), name='Amino Acid'))
+    st.bar_chart(distribution)
 
-def plot_ramachandran():
-    """Plot a sample Ramachandran plot."""
-    x = np.random.uniform(-180, 180, 1000)
-    y = np.random.uniform(-180, 180, 1000)
+@st.cache_data(show_spinner=False)
+def _ramachandran_figure():
+    """Build the sample Ramachandran figure once from seeded random angles."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-180, 180, 1000)
+    y = rng.uniform(-180, 180, 1000)
+    counts, _, _ = np.histogram2d(x, y, bins=100, range=[[-180, 180], [-180, 180]])
+    # Leave bins below 10% of the peak count transparent, like seaborn's pthresh
+    counts = np.where(counts / counts.max() < .1, np.nan, counts)
     fig, ax = plt.subplots(figsize=(6, 6))
-    sns.histplot(x=x, y=y, bins=100, pthresh=.1, cmap="mako", ax=ax)
+    ax.imshow(counts.T, origin='lower', extent=[-180, 180, -180, 180], cmap=sns.color_palette("mako", as_cmap=True))
     ax.set_xlabel('Phi (ϕ) Angle')
     ax.set_ylabel('Psi (ψ) Angle')
     ax.set_title('Sample Ramachandran Plot')
-    st.pyplot(fig)
+    # Unregister from pyplot so neither this figure nor the cached copies stay open
+    plt.close(fig)
+    return fig
+
+def plot_ramachandran():
+    """Plot a sample Ramachandran plot."""
+    st.pyplot(_ramachandran_figure())
 
 # Sidebar for navigation
 st.set_page_config(
@@ -113,9 +197,10 @@ if app_mode == "Single Protein Structure Prediction":
         if input_sequence:
             if validate_sequence(input_sequence):
                 st.write("Predicting structure, please wait...")
-                pdb_str = predict_structure_api(input_sequence)
-                if pdb_str:
-                    st.session_state.pdb_str = pdb_str
+                try:
+                    st.session_state.pdb_str = predict_structure_api(input_sequence)
+                except requests.exceptions.RequestException as e:
+                    st.error(f"Error during prediction: {e}")
             else:
                 st.warning("Invalid sequence. Please enter a valid protein sequence containing only standard amino acid characters.")
         else:
@@ -125,25 +210,17 @@ if app_mode == "Single Protein Structure Prediction":
     if 'pdb_str' in st.session_state:
         st.write("### Predicted Protein Structure")
         visualization_style = st.selectbox("Select Visualization Style:", ["cartoon", "stick"])
-        view = show_structure(st.session_state.pdb_str, style=visualization_style)
-        view_html = view._make_html()
-        st.components.v1.html(view_html, height=500)
+        # Spinning keeps the browser redrawing continuously, so it is opt-in
+        spin = st.checkbox("Auto-rotate", value=False)
+        show_structure(st.session_state.pdb_str, style=visualization_style, spin=spin)
         
-        # Save and allow PDB download
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdb") as temp_pdb:
-            temp_pdb.write(st.session_state.pdb_str.encode())
-            temp_pdb.close()
-            st.download_button(
-                label="Download PDB File",
-                data=open(temp_pdb.name, 'rb').read(),
-                file_name="predicted_structure.pdb",
-                mime="text/plain"
-            )
+        # Allow PDB download
+        show_pdb_download(st.session_state.pdb_str, "Download PDB File", "predicted_structure.pdb")
 
     # Amino Acid Distribution
     if input_sequence and validate_sequence(input_sequence):
         st.write("### Amino Acid Distribution")
-        plot_amino_acid_distribution(input_sequence)
+        plot_amino_acid_distribution(prepare_sequence(input_sequence)[2])
         
         # Ramachandran Plot
         st.write("### Sample Ramachandran Plot")
@@ -159,11 +236,11 @@ elif app_mode == "Multiple Protein Structure Prediction":
     
     sequences = []
     if uploaded_file is not None:
-        sequences = uploaded_file.read().decode('utf-8').split('>')[1:]
-        sequences = [seq.partition('\n')[2].replace('\n', '') for seq in sequences]
+        # Scan the upload in place; only one record at a time is copied out
+        with uploaded_file.getbuffer() as fasta_buffer:
+            sequences = [seq for _, seq in iter_fasta(fasta_buffer)]
     elif input_sequences:
-        sequences = input_sequences.split('>')[1:]
-        sequences = [seq.partition('\n')[2].replace('\n', '') for seq in sequences]
+        sequences = [seq for _, seq in iter_fasta(input_sequences.encode('utf-8'))]
     
     # Processing and prediction
     if sequences:
@@ -172,48 +249,72 @@ elif app_mode == "Multiple Protein Structure Prediction":
         total_sequences = len(sequences)
         valid_sequences = []
         
+        # Filter out sequences that cannot be submitted
+        to_predict = []
+        residues = {}
         for idx, sequence in enumerate(sequences):
-            if len(sequence) > 1500:
+            length, is_valid, residues[idx] = prepare_sequence(sequence)
+            if length > 1500:
                 st.warning(f"Sequence {idx + 1} is too long and will be skipped (max length: 1500 characters).")
                 continue
-            if not validate_sequence(sequence):
+            if not is_valid:
                 st.warning(f"Sequence {idx + 1} contains invalid characters and will be skipped.")
                 continue
+            to_predict.append(idx)
+        
+        # Group duplicate sequences so each distinct one is only predicted once
+        duplicates = {}
+        for idx in to_predict:
+            duplicates.setdefault(residues[idx].tobytes(), []).append(idx)
+        
+        # Predict all sequences concurrently, updating progress as each one completes
+        results = {}
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {executor.submit(predict_structure_api, sequences[indices[0]]): indices for indices in duplicates.values()}
+            for done, future in enumerate(as_completed(futures), start=1):
+                indices = futures[future]
+                try:
+                    pdb_str = future.result()
+                except requests.exceptions.RequestException as e:
+                    labels = ", ".join(str(idx + 1) for idx in indices)
+                    st.error(f"Error during prediction of sequence {labels}: {e}")
+                else:
+                    for idx in indices:
+                        results[idx] = pdb_str
+                progress_bar.progress(done / len(futures))
+        if not futures:
+            progress_bar.progress(1.0)
+        
+        # Single style selector shared by all predicted structures
+        if results:
+            visualization_style = st.selectbox("Select Visualization Style:", ["cartoon", "stick"])
+            # Spinning keeps the browser redrawing continuously, so it is opt-in
+            spin = st.checkbox("Auto-rotate", value=False)
+        
+        for idx in to_predict:
+            sequence = sequences[idx]
+            pdb_str = results.get(idx)
+            if not pdb_str:
+                continue
             
-            st.write(f"### Predicted Structure for Sequence {idx + 1}")
-            pdb_str = predict_structure_api(sequence)
-            
-            # Display 3D visualization
-            if pdb_str:
-                visualization_style = st.selectbox(f"Select Visualization Style for Sequence {idx + 1}:", ["cartoon", "stick"], key=f"style_{idx}")
-                view = show_structure(pdb_str, style=visualization_style)
-                view_html = view._make_html()
-                st.components.v1.html(view_html, height=500)
+            with st.expander(f"Predicted Structure for Sequence {idx + 1}"):
+                # Expander contents always run, so only embed the 3D viewer when asked for
+                if st.checkbox("Show 3D Structure", key=f"show_{idx}"):
+                    show_structure(pdb_str, style=visualization_style, spin=spin)
                 
-                # Save and allow PDB download
-                with tempfile.NamedTemporaryFile(delete=False, suffix=f"_sequence_{idx + 1}.pdb") as temp_pdb:
-                    temp_pdb.write(pdb_str.encode())
-                    temp_pdb.close()
-                    st.download_button(
-                        label=f"Download PDB File for Sequence {idx + 1}",
-                        data=open(temp_pdb.name, 'rb').read(),
-                        file_name=f"predicted_structure_sequence_{idx + 1}.pdb",
-                        mime="text/plain"
-                    )
+                # Allow PDB download
+                show_pdb_download(pdb_str, f"Download PDB File for Sequence {idx + 1}", f"predicted_structure_sequence_{idx + 1}.pdb")
                 valid_sequences.append(sequence)
                 
                 # Amino Acid Distribution
                 st.write(f"### Amino Acid Distribution for Sequence {idx + 1}")
-                plot_amino_acid_distribution(sequence)
-                
-                # Ramachandran Plot
-                st.write(f"### Sample Ramachandran Plot for Sequence {idx + 1}")
-                plot_ramachandran()
-            
-            # Update progress
-            progress_bar.progress((idx + 1) / total_sequences)
+                plot_amino_acid_distribution(residues[idx])
         
         if valid_sequences:
+            # Ramachandran Plot (sample data, identical for every sequence, so shown once)
+            st.write("### Sample Ramachandran Plot")
+            plot_ramachandran()
+            
             st.write(f"**Summary:** Successfully processed {len(valid_sequences)} out of {total_sequences} sequences.")
     else:
         st.warning("Please upload a valid FASTA file or enter sequences in the provided text area.")